@@ -2,6 +2,8 @@
 
 \defgroup python_api Python API
 """
+import collections
+import itertools
 import os
 import platform
 import sys
@@ -18,9 +20,12 @@ from procman_lcm.cmd_status_t import cmd_status_t
 from procman_lcm.discovery_t import discovery_t
 import procman.sheriff_config as sheriff_config
 
+# Set to True to print debugging messages.  Call sites check this before
+# calling _dbg() so that message formatting is skipped when it's False.
+_DEBUG = False
+
 def _dbg(text):
-    return
-#    sys.stderr.write("%s\n" % text)
+    sys.stderr.write("%s\n" % text)
 
 def _warn(text):
     sys.stderr.write("[WARNING] %s\n" % text)
@@ -60,6 +65,52 @@ RESTARTING = "Restarting (Command Sent)"
 DEFAULT_STOP_SIGNAL = signal.SIGINT
 DEFAULT_STOP_TIME_ALLOWED = 7
 
+# How often (seconds) the sheriff retransmits orders to its deputies when
+# nothing has changed.
+_ORDERS_SEND_INTERVAL = 1.0
+
+# Placeholder in _STATUS_TABLE for a stopped command, whose status depends on
+# how it exited.
+_CHECK_EXIT_CODE = object()
+
+def _make_status_table():
+    # Precomputes the status of a command for every combination of the flags
+    #   (updated_from_info, desired_runid == actual_runid, pid > 0, pid == 0,
+    #    force_quit, scheduled_for_removal)
+    table = {}
+    for key in itertools.product((False, True), repeat=6):
+        updated, same_runid, running, not_started, force_quit, removing = key
+        if not updated:
+            status = UNKNOWN
+        elif not same_runid and not force_quit:
+            if not_started:
+                status = TRYING_TO_START
+            else:
+                status = RESTARTING
+        elif same_runid:
+            if running:
+                if not force_quit and not removing:
+                    status = RUNNING
+                else:
+                    status = TRYING_TO_STOP
+            elif removing:
+                status = REMOVING
+            else:
+                status = _CHECK_EXIT_CODE
+        else:
+            status = UNKNOWN
+        table[key] = status
+    return table
+
+_STATUS_TABLE = _make_status_table()
+
+# Config attribute values that are treated as true.
+_CONFIG_TRUE_VALUES = frozenset(("true", "yes"))
+
+# Signals that count as a clean exit for a command that was asked to stop.
+_CLEAN_EXIT_SIGNALS = frozenset((signal.SIGTERM, signal.SIGINT,
+    signal.SIGKILL))
+
 def load_config_file(file_obj):
     return sheriff_config.Parser().parse(file_obj)
 
@@ -76,6 +127,13 @@ class Command(object):
 
     \ingroup python_api
     """
+    __slots__ = ("_lock", "_pid", "_exit_code", "_cpu_usage",
+            "_mem_vsize_bytes", "_mem_rss_bytes", "_exec_str", "_command_id",
+            "_group", "_group_parts", "_desired_runid", "_force_quit",
+            "_scheduled_for_removal", "_actual_runid", "_auto_respawn",
+            "_stop_signal", "_stop_time_allowed", "_updated_from_info",
+            "_status_cache")
+
     def __init__(self, lock):
         self._lock = lock
 
@@ -93,6 +151,8 @@ class Command(object):
         self._exec_str = ""
         self._command_id = ""
         self._group = ""
+        # self._group split on "/", used for group membership queries.
+        self._group_parts = ("",)
         self._desired_runid = 0
         self._force_quit = False
         # True if the command is being removed.
@@ -106,64 +166,62 @@ class Command(object):
         # True if this data structure has been updated with information
         # received from a deputy, False if not.
         self._updated_from_info = False
+        # Memoized result of _status(), or None if it needs to be recomputed.
+        # Reset to None whenever a field that affects the status changes.
+        self._status_cache = None
+
+    # Properties that return a single attribute read it without the lock.
+    # Each attribute is replaced atomically, so readers never see a partial
+    # update.
 
     @property
     def cpu_usage(self):
         """Command CPU usage, as reported by the deputy.  Ranges from [0, 1]"""
-        with self._lock:
-            return self._cpu_usage
+        return self._cpu_usage
 
     @property
     def mem_vsize_bytes(self):
         """Virtual memory used by the command."""
-        with self._lock:
-            return self._mem_vsize_bytes
+        return self._mem_vsize_bytes
 
     @property
     def mem_rss_bytes(self):
         """Physical memory used by the command."""
-        with self._lock:
-            return self._mem_rss_bytes
+        return self._mem_rss_bytes
 
     @property
     def exec_str(self):
         """The executable string for the command."""
-        with self._lock:
-            return self._exec_str
+        return self._exec_str
 
     @property
     def command_id(self):
         """A user-assigned string that uniquely idenitifies the comand."""
-        with self._lock:
-            return self._command_id
+        return self._command_id
 
     @property
     def group(self):
         """A user-assigned group name for the command, possibly empty."""
-        with self._lock:
-            return self._group
+        return self._group
 
     @property
     def auto_respawn(self):
         """True if the deputy should automatically restart the command when it
         exits.  Auto respawn only happens if the command is set to running.
         """
-        with self._lock:
-            return self._auto_respawn
+        return self._auto_respawn
 
     @property
     def stop_signal(self):
         """When stopping the command, which OS signal to send the command to
         request that it cleanly exit.  This usually defaults to SIGINT."""
-        with self._lock:
-            return self._stop_signal
+        return self._stop_signal
 
     @property
     def stop_time_allowed(self):
         """When stopping the command, how much time to wait in between sending
         it stop_signal and a SIGKILL."""
-        with self._lock:
-            return self._stop_time_allowed
+        return self._stop_time_allowed
 
     def _update_from_cmd_info(self, cmd_msg):
         self._pid = cmd_msg.pid
@@ -173,6 +231,7 @@ class Command(object):
         self._mem_vsize_bytes = cmd_msg.mem_vsize_bytes
         self._mem_rss_bytes = cmd_msg.mem_rss_bytes
         self._updated_from_info = True
+        self._status_cache = None
 
         # This conditional triggers when the sheriff just started up and loaded
         # a config file, and a deputy already had a running process. In that
@@ -191,63 +250,77 @@ class Command(object):
             not self._force_quit:
                 self._force_quit = True
 
+    @classmethod
+    def _from_cmd_msg(cls, lock, cmd_msg, desired_runid):
+        # Creates a Command for a command first reported in a cmd_status_t or
+        # cmd_desired_t message.
+        cmd = cls(lock)
+        cmd_t_msg = cmd_msg.cmd
+        cmd._exec_str = cmd_t_msg.exec_str
+        cmd._command_id = sys.intern(cmd_t_msg.command_id)
+        cmd._set_group(cmd_t_msg.group)
+        cmd._auto_respawn = cmd_t_msg.auto_respawn
+        cmd._stop_signal = cmd_t_msg.stop_signal
+        cmd._stop_time_allowed = cmd_t_msg.stop_time_allowed
+        cmd._desired_runid = desired_runid
+        return cmd
+
+    def _set_group(self, group):
+        if group == self._group:
+            return
+        # Group names are shared by many commands, so intern them.
+        group = sys.intern(group)
+        self._group = group
+        self._group_parts = tuple(group.split("/"))
+
     def _update_from_cmd_orders(self, cmd_msg):
         # Expects that self._lock is already acquired
+        # The command id is not updated, since the command was looked up by it.
         self._exec_str = cmd_msg.cmd.exec_str
-        self._command_id = cmd_msg.cmd.command_id
-        self._group = cmd_msg.cmd.group
+        self._set_group(cmd_msg.cmd.group)
         self._desired_runid = cmd_msg.desired_runid
         self._force_quit = cmd_msg.force_quit
         self._stop_signal = cmd_msg.cmd.stop_signal
         self._stop_time_allowed = cmd_msg.cmd.stop_time_allowed
+        self._status_cache = None
 
     def _start(self):
         # if the command is already running, then ignore
         if self._pid > 0 and not self._force_quit:
             return
-
-        self._desired_runid += 1
-        if self._desired_runid > (2 << 31):
-            self._desired_runid = 1
-        self._force_quit = False
+        self._restart()
 
     def _restart(self):
-        self._desired_runid += 1
-        if self._desired_runid > (2 << 31):
-            self._desired_runid = 1
+        # desired_runid is an int32 on the wire.  Wrap around to 1, skipping 0.
+        self._desired_runid = ((self._desired_runid + 1) & 0x7FFFFFFF) or 1
         self._force_quit = False
+        self._status_cache = None
 
     def _stop(self):
         self._force_quit = True
+        self._status_cache = None
 
     def _status(self):
-        if not self._updated_from_info:
-            return UNKNOWN
-        if self._desired_runid != self._actual_runid and not self._force_quit:
-            if self._pid == 0:
-                return TRYING_TO_START
-            else:
-                return RESTARTING
-        elif self._desired_runid == self._actual_runid:
-            if self._pid > 0:
-                if not self._force_quit and not self._scheduled_for_removal:
-                    return RUNNING
-                else:
-                    return TRYING_TO_STOP
-            else:
-                if self._scheduled_for_removal:
-                    return REMOVING
-                elif self._exit_code == 0:
-                    return STOPPED_OK
-                elif self._force_quit and \
-                     os.WIFSIGNALED(self._exit_code) and \
-                     os.WTERMSIG(self._exit_code) in [ signal.SIGTERM,
-                             signal.SIGINT, signal.SIGKILL ]:
-                         return STOPPED_OK
-                else:
-                    return STOPPED_ERROR
+        if self._status_cache is None:
+            self._status_cache = self._compute_status()
+        return self._status_cache
+
+    def _compute_status(self):
+        pid = self._pid
+        status = _STATUS_TABLE[(self._updated_from_info,
+                self._desired_runid == self._actual_runid,
+                pid > 0, pid == 0,
+                self._force_quit, self._scheduled_for_removal)]
+        if status is not _CHECK_EXIT_CODE:
+            return status
+        if self._exit_code == 0:
+            return STOPPED_OK
+        elif self._force_quit and \
+             os.WIFSIGNALED(self._exit_code) and \
+             os.WTERMSIG(self._exit_code) in _CLEAN_EXIT_SIGNALS:
+            return STOPPED_OK
         else:
-            return UNKNOWN
+            return STOPPED_ERROR
 
     def status(self):
         """Retrieve the status of the command, as understood by the
@@ -271,6 +344,10 @@ class Deputy(object):
 
     \ingroup python_api
     """
+    __slots__ = ("_deputy_id", "_cpu_load", "_phys_mem_total_bytes",
+            "_phys_mem_free_bytes", "_last_update_utime", "_lock", "_commands",
+            "_scheduled_for_removal_ids", "_orders_msg")
+
     def __init__(self, deputy_id, lock):
         """Initializes a deputy with the specified id.  Do not use this
         constructor directly.  Instead, get a list of deputies from the
@@ -286,6 +363,13 @@ class Deputy(object):
         # Dictionary of commands owned by the deputy
         self._commands = {}
 
+        # Ids of the commands in self._commands that are scheduled for removal
+        self._scheduled_for_removal_ids = set()
+
+        # Cached orders message for the deputy.  Set to None whenever the
+        # desired state of a command changes, so that it gets rebuilt.
+        self._orders_msg = None
+
     def get_commands(self):
         """Retrieve a list of all commands managed by the deputy
 
@@ -294,145 +378,158 @@ class Deputy(object):
         with self._lock:
             return list(self._commands.values())
 
+    # As with Command, single-attribute properties are read without the lock.
+
     @property
     def deputy_id(self):
         """Deputy id"""
-        with self._lock:
-            return self._deputy_id
+        return self._deputy_id
 
     @property
     def cpu_load(self):
         """Last reported CPU load on the deputy.  Ranges from [0, 1], where 0
         is no load and 1 is fully loaded.
         """
-        with self._lock:
-            return self._cpu_load
+        return self._cpu_load
 
     @property
     def phys_mem_total_bytes(self):
         """Last reported total memory (in bytes) on the deputy."""
-        with self._lock:
-            return self._phys_mem_total_bytes
+        return self._phys_mem_total_bytes
 
     @property
     def phys_mem_free_bytes(self):
         """Last reported free memory (in bytes) on the deputy."""
-        with self._lock:
-            return self._phys_mem_free_bytes
+        return self._phys_mem_free_bytes
 
     @property
     def last_update_utime(self):
         """Last time info from te deputy was received.  Zero if no info has
         ever been received.  Represented in microseconds since the epoch.
         """
-        with self._lock:
-            return self._last_update_utime
+        return self._last_update_utime
 
     def _owns_command(self, cmd_obj):
         return cmd_obj._command_id in self._commands and \
                 self._commands[cmd_obj._command_id] is cmd_obj
 
-    def _update_from_deputy_info(self, dep_info_msg):
+    def _update_from_deputy_info(self, dep_info_msg, now_utime):
         # Expects that self._lock is already acquired
-
+        #
+        # Returns a list of (cmd, old_status, new_status) for each command
+        # whose status changed.
         status_changes = []
+        updated_ids = set()
         for cmd_msg in dep_info_msg.cmds:
+            command_id = cmd_msg.cmd.command_id
+            updated_ids.add(command_id)
+
             # look up the command, or create a new one if it's not found
-            if cmd_msg.cmd.command_id in self._commands:
-                cmd = self._commands[cmd_msg.cmd.command_id]
+            cmd = self._commands.get(command_id)
+            if cmd is not None:
                 old_status = cmd._status()
             else:
-                cmd = Command(self._lock)
-                cmd._exec_str = cmd_msg.cmd.exec_str
-                cmd._command_id = cmd_msg.cmd.command_id
-                cmd._group = cmd_msg.cmd.group
-                cmd._auto_respawn = cmd_msg.cmd.auto_respawn
-                cmd._desired_runid = cmd_msg.actual_runid
-                cmd._stop_signal = cmd_msg.cmd.stop_signal
-                cmd._stop_time_allowed = cmd_msg.cmd.stop_time_allowed
+                cmd = Command._from_cmd_msg(self._lock, cmd_msg,
+                        cmd_msg.actual_runid)
                 self._add_command(cmd)
                 old_status = None
 
+            old_desired = (cmd._desired_runid, cmd._force_quit)
             cmd._update_from_cmd_info(cmd_msg)
+            if old_desired != (cmd._desired_runid, cmd._force_quit):
+                self._orders_msg = None
             new_status = cmd._status()
 
             if old_status != new_status:
                 status_changes.append((cmd, old_status, new_status))
 
-        updated_ids = [ cmd_msg.cmd.command_id for cmd_msg in dep_info_msg.cmds ]
-
-        can_safely_remove = [ cmd for cmd in list(self._commands.values()) \
-                if cmd._scheduled_for_removal and \
-                cmd._command_id not in updated_ids ]
-
-        for toremove in can_safely_remove:
-            cmd = self._commands[toremove._command_id]
+        # Commands scheduled for removal that the deputy no longer reports can
+        # be safely removed.
+        can_safely_remove = self._scheduled_for_removal_ids - updated_ids
+        for command_id in can_safely_remove:
+            cmd = self._commands.pop(command_id)
+            self._scheduled_for_removal_ids.discard(command_id)
             old_status = cmd._status()
             status_changes.append((cmd, old_status, None))
-            del self._commands[toremove._command_id]
 
-        self._last_update_utime = _now_utime()
+        self._last_update_utime = now_utime
         self._cpu_load = dep_info_msg.cpu_load
         self._phys_mem_total_bytes = dep_info_msg.phys_mem_total_bytes
         self._phys_mem_free_bytes = dep_info_msg.phys_mem_free_bytes
         return status_changes
 
     def _update_from_deputy_orders(self, orders_msg):
+        # Like _update_from_deputy_info(), returns a list of status changes.
+        self._orders_msg = None
         status_changes = []
+        updated_ids = set()
         for cmd_msg in orders_msg.cmds:
-            if cmd_msg.cmd.command_id in self._commands:
-                cmd = self._commands[cmd_msg.cmd.command_id]
+            command_id = cmd_msg.cmd.command_id
+            updated_ids.add(command_id)
+            cmd = self._commands.get(command_id)
+            if cmd is not None:
                 old_status = cmd._status()
             else:
-                cmd = Command(self._lock)
-                cmd._exec_str = cmd_msg.cmd.exec_str
-                cmd._command_id = cmd_msg.cmd.command_id
-                cmd._group = cmd_msg.cmd.group
-                cmd._auto_respawn = cmd_msg.cmd.auto_respawn
-                cmd._stop_signal = cmd_msg.cmd.stop_signal
-                cmd._stop_time_allowed = cmd_msg.cmd.stop_time_allowed
-                cmd._desired_runid = cmd_msg.desired_runid
+                cmd = Command._from_cmd_msg(self._lock, cmd_msg,
+                        cmd_msg.desired_runid)
                 self._add_command(cmd)
                 old_status = None
             cmd._update_from_cmd_orders(cmd_msg)
             new_status = cmd._status()
             if old_status != new_status:
                 status_changes.append((cmd, old_status, new_status))
-        updated_ids = set([ cmd_msg.cmd.command_id for cmd_msg in orders_msg.cmds ])
-        for cmd in list(self._commands.values()):
-            if cmd._command_id not in updated_ids:
-                old_status = cmd._status()
-                cmd._scheduled_for_removal = True
-                new_status = cmd._status()
-                if old_status != new_status:
-                    status_changes.append((cmd, old_status, new_status))
+        # Commands missing from the orders are being removed.  The key view
+        # difference finds them without a Python-level scan of every command.
+        for command_id in self._commands.keys() - updated_ids:
+            cmd = self._commands[command_id]
+            old_status = cmd._status()
+            cmd._scheduled_for_removal = True
+            cmd._status_cache = None
+            self._scheduled_for_removal_ids.add(command_id)
+            new_status = cmd._status()
+            if old_status != new_status:
+                status_changes.append((cmd, old_status, new_status))
         return status_changes
 
     def _add_command(self, newcmd):
         assert isinstance(newcmd, Command)
         self._commands[newcmd._command_id] = newcmd
+        self._orders_msg = None
 
     def _schedule_for_removal(self, cmd):
         if not self._owns_command(cmd):
             raise KeyError("invalid command")
         old_status = cmd._status()
         cmd._scheduled_for_removal = True
+        cmd._status_cache = None
+        self._orders_msg = None
         if not self._last_update_utime:
             del self._commands[cmd._command_id]
             new_status = None
         else:
+            self._scheduled_for_removal_ids.add(cmd._command_id)
             new_status = cmd._status()
+        if old_status == new_status:
+            return ()
         return ((cmd, old_status, new_status),)
 
-    def _make_orders_message(self, sheriff_id):
+    def _make_orders_message(self, sheriff_id, now_utime):
+        # Reuse the cached message if nothing has changed since it was built,
+        # and only refresh its timestamp.
+        msg = self._orders_msg
+        if msg is None or msg.sheriff_id != sheriff_id:
+            msg = self._build_orders_message(sheriff_id)
+            self._orders_msg = msg
+        msg.utime = now_utime
+        return msg
+
+    def _build_orders_message(self, sheriff_id):
         msg = orders_t()
-        msg.utime = _now_utime()
         msg.deputy_id = self._deputy_id
-        msg.ncmds = len(self._commands)
         msg.sheriff_id = sheriff_id
-        for cmd in list(self._commands.values()):
+        for cmd in self._commands.values():
+            # Commands being removed are left out of the orders.
             if cmd._scheduled_for_removal:
-                msg.ncmds -= 1
                 continue
             cmd_msg = cmd_desired_t()
             cmd_msg.cmd = cmd_t()
@@ -445,6 +542,7 @@ class Deputy(object):
             cmd_msg.desired_runid = cmd._desired_runid
             cmd_msg.force_quit = cmd._force_quit
             msg.cmds.append(cmd_msg)
+        msg.ncmds = len(msg.cmds)
         return msg
 
 class SheriffListener(object):
@@ -550,7 +648,15 @@ class Sheriff(object):
             self._lcm_thread_obj = threading.Thread(target = self._lcm_thread)
         self._lcm.subscribe("PM_INFO", self._on_pmd_info)
         self._lcm.subscribe("PM_ORDERS", self._on_pmd_orders)
+        # Maps deputy ids to Deputy objects.  The dict is copy-on-write: it is
+        # never modified in place, but replaced (with _lock held) whenever a
+        # deputy is added or removed.  This lets readers iterate it without
+        # the lock.
         self._deputies = {}
+        # Maps the id of every command known to the sheriff to the Deputy
+        # that owns it.  If several deputies report a command with the same
+        # id, the entry stays with the deputy that reported it first.
+        self._command_deputies = {}
         self._is_observer = False
         self._id = platform.node() + ":" + str(os.getpid()) + \
                 ":" + str(_now_utime())
@@ -565,86 +671,136 @@ class Sheriff(object):
         # Create a worker thread for periodically publishing orders
         self._worker_thread_obj = threading.Thread(target = self._worker_thread)
         self._exiting = False
+        # True if orders have changed and should be transmitted by the worker
+        # thread at its next wakeup.
+        self._orders_dirty = False
+        # _lock guards the deputies and their commands.  _emit_lock guards
+        # the listener list, the event queue, and the worker thread's wakeup
+        # state, so that queueing events never contends with long scans of
+        # the deputy table.  When both are needed, _lock is acquired first.
         self._lock = threading.Lock()
-        self._condvar = threading.Condition(self._lock)
-        self._worker_thread_obj.start()
-
+        self._emit_lock = threading.Lock()
+        self._condvar = threading.Condition(self._emit_lock)
         self._listeners = []
-        self._queued_events = []
+        self._queued_events = collections.deque()
+        # Maps a Command to its [old_status, new_status] status change in
+        # _queued_events, for status changes not yet dispatched.
+        self._pending_status_changes = {}
+        self._worker_thread_obj.start()
 
     def _get_or_make_deputy(self, deputy_id):
         # _lock should already be acquired
-        if deputy_id not in self._deputies:
-            self._deputies[deputy_id] = Deputy(deputy_id, self._lock)
-        return self._deputies[deputy_id]
+        deputy = self._deputies.get(deputy_id)
+        if deputy is None:
+            # Interned, since every message from the deputy repeats its id.
+            deputy_id = sys.intern(deputy_id)
+            deputy = Deputy(deputy_id, self._lock)
+            deputies = dict(self._deputies)
+            deputies[deputy_id] = deputy
+            self._deputies = deputies
+        return deputy
+
+    def _queue_event(self, event):
+        # Queues a listener notification for the worker thread.  An event is a
+        # tuple of the SheriffListener method name followed by its arguments.
+        with self._emit_lock:
+            self._queued_events.append(event)
+            self._condvar.notify()
 
     def __deputy_info_received(self, deputy_obj):
-        self._queued_events.append(lambda listener:
-                listener.deputy_info_received(deputy_obj))
-        self._condvar.notify()
+        self._queue_event(("deputy_info_received", deputy_obj))
 
     def __command_added(self, deputy_obj, cmd_obj):
-        self._queued_events.append(lambda listener:
-                listener.command_added(deputy_obj, cmd_obj))
-        self._condvar.notify()
+        # _emit_lock should already be acquired
+        self._queued_events.append(("command_added", deputy_obj, cmd_obj))
 
     def __command_removed(self, deputy_obj, cmd_obj):
-        self._queued_events.append(lambda listener:
-                listener.command_removed(deputy_obj, cmd_obj))
-        self._condvar.notify()
+        # _emit_lock should already be acquired
+        self._queued_events.append(("command_removed", deputy_obj, cmd_obj))
 
     def __command_status_changed(self, cmd_obj, old_status, new_status):
-        self._queued_events.append(lambda listener:
-                listener.command_status_changed(cmd_obj,
-                    old_status, new_status))
-        self._condvar.notify()
+        # _emit_lock should already be acquired
+        #
+        # If a status change for this command is already queued, fold this
+        # change into it so that listeners only see the net transition.
+        change = self._pending_status_changes.get(cmd_obj)
+        if change is not None:
+            change[1] = new_status
+            return
+        change = [old_status, new_status]
+        self._pending_status_changes[cmd_obj] = change
+        # The worker thread unpacks change when dispatching the event.
+        self._queued_events.append(("command_status_changed", cmd_obj, change))
 
     def __command_group_changed(self, cmd_obj):
-        self._queued_events.append(lambda listener:
-                listener.command_group_changed(cmd_obj))
-        self._condvar.notify()
+        self._queue_event(("command_group_changed", cmd_obj))
 
     def __sheriff_conflict_detected(self, other_sheriff_id):
-        self._queued_events.append(lambda listener:
-                listener.sheriff_conflict_detected(other_sheriff_id))
-        self._condvar.notify()
+        self._queue_event(("sheriff_conflict_detected", other_sheriff_id))
 
     def __observer_status_changed(self, is_observer):
-        self._queued_events.append(lambda listener:
-                listener.observer_status_changed(is_observer))
-        self._condvar.notify()
+        self._queue_event(("observer_status_changed", is_observer))
 
     def _maybe_emit_status_change_signals(self, deputy, status_changes):
         # _lock should already be acquired
-        for cmd, old_status, new_status in status_changes:
-            if old_status == new_status:
-                continue
-            if old_status is None:
-                self.__command_added(deputy, cmd)
-            elif new_status is None:
-                self.__command_removed(deputy, cmd)
-            else:
-                self.__command_status_changed(cmd, old_status, new_status)
+        #
+        # status_changes only contains entries where the status changed.  All
+        # of the resulting events are queued with a single wakeup of the
+        # worker thread.
+        if not status_changes:
+            return
+        with self._emit_lock:
+            for cmd, old_status, new_status in status_changes:
+                if old_status is None:
+                    self._add_to_command_index(deputy, cmd._command_id)
+                    self.__command_added(deputy, cmd)
+                elif new_status is None:
+                    self._remove_from_command_index(deputy, cmd._command_id)
+                    self.__command_removed(deputy, cmd)
+                else:
+                    self.__command_status_changed(cmd, old_status, new_status)
+            self._condvar.notify()
 
-    def _get_command_deputy(self, cmd):
+    def _add_to_command_index(self, deputy, command_id):
         # _lock should already be acquired
-        for deputy in list(self._deputies.values()):
-            if deputy._owns_command(cmd):
-                return deputy
-        raise KeyError()
+        current = self._command_deputies.get(command_id)
+        if current is None or command_id not in current._commands:
+            self._command_deputies[command_id] = deputy
+
+    def _remove_from_command_index(self, deputy, command_id):
+        # _lock should already be acquired
+        if self._command_deputies.get(command_id) is not deputy:
+            return
+        del self._command_deputies[command_id]
+        # Hand the entry over to another deputy with a command of that id.
+        for other in self._deputies.values():
+            if other is not deputy and command_id in other._commands:
+                self._command_deputies[command_id] = other
+                break
+
+    def _invalidate_orders(self, cmd):
+        # _lock should already be acquired
+        #
+        # Rebuilds the command's orders and sends them right away instead of
+        # waiting for the next periodic transmission.
+        try:
+            self._get_command_deputy(cmd)._orders_msg = None
+        except KeyError:
+            return
+        self._schedule_send_orders()
 
     def add_listener(self, sheriff_listener):
         """Adds a listener that gets notified of certain Sheriff activity.
 
         @param sheriff_listener a SheriffListener object.
         """
-        with self._lock:
+        with self._emit_lock:
             self._listeners.append(sheriff_listener)
 
     def remove_listener(self, sheriff_listener):
         """Removes a listener that was added with add_listener().
         """
-        with self._lock:
+        with self._emit_lock:
             self._listeners.remove(sheriff_listener)
 
     def _on_pmd_info(self, _, data):
@@ -655,22 +811,25 @@ class Sheriff(object):
             _warn("invalid deputy_info_t message")
             return
 
+        # Filter out old messages before acquiring the lock.  _is_observer is
+        # a plain bool, so reading it without the lock is safe.
         now = _now_utime()
-        if(now - info_msg.utime) * 1e-6 > 30 and not self.is_observer():
+        if(now - info_msg.utime) * 1e-6 > 30 and not self._is_observer:
             # ignore old messages
             return
 
-#        _dbg("received pmd info from [%s]" % info_msg.deputy_id)
+        if _DEBUG:
+            _dbg("received pmd info from [%s]" % info_msg.deputy_id)
 
         with self._lock:
             deputy = self._get_or_make_deputy(info_msg.deputy_id)
 
             # Check if this is the first time we've heard from the deputy and
             # we already have a desired state for the deputy.
-            if not deputy._last_update_utime and deputy._commands:
+            if _DEBUG and not deputy._last_update_utime and deputy._commands:
                 _dbg("First update from [%s]" % info_msg.deputy_id)
 
-            status_changes = deputy._update_from_deputy_info(info_msg)
+            status_changes = deputy._update_from_deputy_info(info_msg, now)
 
             self.__deputy_info_received(deputy)
             self._maybe_emit_status_change_signals(deputy, status_changes)
@@ -695,7 +854,7 @@ class Sheriff(object):
         """Terminates the sheriff and stops the internal worker thread.
         """
         # signal worker thread
-        with self._lock:
+        with self._emit_lock:
             self._exiting = True
             self._condvar.notify()
 
@@ -708,11 +867,12 @@ class Sheriff(object):
 
     def _send_orders(self):
         """Transmit orders to all deputies.  Call this method for the sheriff
-        to send updated orders to its deputies.  This method is automatically
-        called when you call other sheriff methods such as add_command(),
-        start_command(), etc.  In general, you should only need to explicitly
-        call this method for a periodic transmission to be robust against
-        network failures and dropped messages.
+        to send updated orders to its deputies.  Other sheriff methods such
+        as add_command(), start_command(), etc. schedule a transmission via
+        _schedule_send_orders(), which the worker thread carries out.  In
+        general, you should only need to explicitly call this method for a
+        periodic transmission to be robust against network failures and
+        dropped messages.
 
         @note Orders will only be sent to a deputy if the sheriff has received at
         least one update from the deputy.
@@ -720,11 +880,25 @@ class Sheriff(object):
         # self._lock should already be acquired
         if self._is_observer:
             raise ValueError("Can't send orders in Observer mode")
-        for deputy in list(self._deputies.values()):
-            # only send orders to a deputy if we've heard from it.
-            if deputy._last_update_utime > 0:
-                msg = deputy._make_orders_message(self._id)
-                self._lcm.publish("PM_ORDERS", msg.encode())
+        # Encode all orders up front so that the messages for every deputy
+        # are published back to back.  Only send orders to a deputy if we've
+        # heard from it.
+        now = _now_utime()
+        encoded = [ deputy._make_orders_message(self._id, now).encode()
+                for deputy in self._deputies.values()
+                if deputy._last_update_utime > 0 ]
+        for data in encoded:
+            self._lcm.publish("PM_ORDERS", data)
+
+    def _schedule_send_orders(self):
+        # self._lock should already be acquired
+        #
+        # Instead of transmitting orders immediately, mark them as dirty and
+        # wake up the worker thread.  This coalesces a burst of modifications
+        # (e.g., loading a config file) into a single transmission.
+        with self._emit_lock:
+            self._orders_dirty = True
+            self._condvar.notify()
 
     def _add_command(self, command_id, deputy_id, exec_str,
                     group_name, auto_respawn, stop_signal, stop_time_allowed):
@@ -736,21 +910,25 @@ class Sheriff(object):
             raise ValueError("Invalid command")
         if not command_id:
             raise ValueError("Invalid command id")
-        if self._get_command(command_id):
+        if command_id in self._command_deputies:
             raise ValueError("Duplicate command id %s" % command_id)
         if not deputy_id:
             raise ValueError("Invalid deputy")
+        command_id = sys.intern(command_id)
         dep = self._get_or_make_deputy(deputy_id)
         newcmd = Command(self._lock)
         newcmd._exec_str = exec_str
         newcmd._command_id = command_id
-        newcmd._group = group_name
+        newcmd._set_group(group_name)
         newcmd._auto_respawn = auto_respawn
         newcmd._stop_signal = stop_signal
         newcmd._stop_time_allowed = stop_time_allowed
         dep._add_command(newcmd)
-        self.__command_added(dep, newcmd)
-        self._send_orders()
+        self._command_deputies[command_id] = dep
+        with self._emit_lock:
+            self.__command_added(dep, newcmd)
+            self._condvar.notify()
+        self._schedule_send_orders()
         return newcmd
 
     def add_command(self, command_id, deputy_id, exec_str,
@@ -781,7 +959,8 @@ class Sheriff(object):
                     group_name, auto_respawn, stop_signal, stop_time_allowed)
 
     def _start_command(self, cmd):
-        _dbg("start_command [%s]" % cmd._command_id)
+        if _DEBUG:
+            _dbg("start_command [%s]" % cmd._command_id)
         # self._lock should already be acquired
         if self._is_observer:
             raise ValueError("Can't modify commands in Observer mode")
@@ -789,9 +968,11 @@ class Sheriff(object):
         cmd._start()
         new_status = cmd._status()
         deputy = self._get_command_deputy(cmd)
-        self._maybe_emit_status_change_signals(deputy,
-                ((cmd, old_status, new_status),))
-        self._send_orders()
+        deputy._orders_msg = None
+        if old_status != new_status:
+            self._maybe_emit_status_change_signals(deputy,
+                    ((cmd, old_status, new_status),))
+        self._schedule_send_orders()
 
     def start_command(self, cmd):
         """Sets a command's desired status to running.  If the command is not
@@ -811,9 +992,11 @@ class Sheriff(object):
         cmd._restart()
         new_status = cmd._status()
         deputy = self._get_command_deputy(cmd)
-        self._maybe_emit_status_change_signals(deputy,
-                ((cmd, old_status, new_status),))
-        self._send_orders()
+        deputy._orders_msg = None
+        if old_status != new_status:
+            self._maybe_emit_status_change_signals(deputy,
+                    ((cmd, old_status, new_status),))
+        self._schedule_send_orders()
 
     def restart_command(self, cmd):
         """Starts a command if it's not running, or stop and then start it if it's
@@ -835,9 +1018,11 @@ class Sheriff(object):
         cmd._stop()
         new_status = cmd._status()
         deputy = self._get_command_deputy(cmd)
-        self._maybe_emit_status_change_signals(deputy,
-                ((cmd, old_status, new_status),))
-        self._send_orders()
+        deputy._orders_msg = None
+        if old_status != new_status:
+            self._maybe_emit_status_change_signals(deputy,
+                    ((cmd, old_status, new_status),))
+        self._schedule_send_orders()
 
     def stop_command(self, cmd):
         """Sets a command's desired status to stopped.  If the command is
@@ -858,8 +1043,13 @@ class Sheriff(object):
         @param cmd a Command object.
         @param exec_str the actual command string to execute.
         """
+        # Skip the lock entirely for redundant updates, e.g., from a GUI
+        # re-submitting unchanged values.
+        if cmd._exec_str == exec_str:
+            return
         with self._lock:
             cmd._exec_str = exec_str
+            self._invalidate_orders(cmd)
 
     def set_command_group(self, cmd, group_name):
         """Set the command group.
@@ -867,14 +1057,13 @@ class Sheriff(object):
         @param cmd a Command object.
         @param group_name the new group name for the command.
         """
-        group_name = group_name.strip("/")
-        while group_name.find("//") >= 0:
-            group_name = group_name.replace("//", "/")
+        group_name = sheriff_config.normalize_group_name(group_name)
         with self._lock:
             if self._is_observer:
                 raise ValueError("Can't modify commands in Observer mode")
             if cmd._group != group_name:
-                cmd._group = group_name
+                cmd._set_group(group_name)
+                self._invalidate_orders(cmd)
                 self.__command_group_changed(cmd)
 
     def set_command_auto_respawn(self, cmd, newauto_respawn):
@@ -885,22 +1074,32 @@ class Sheriff(object):
         @param newauto_respawn True if the command should be automatically
         restarted.
         """
+        if cmd._auto_respawn == newauto_respawn:
+            return
         with self._lock:
             cmd._auto_respawn = newauto_respawn
+            self._invalidate_orders(cmd)
 
     def set_command_stop_signal(self, cmd, new_stop_signal):
         """Set the OS signal that is sent to a command when requesting it to
         stop cleanly.  If the command doesn't cleanly exit within the stop time
         allowed, then it is sent a SIGKILL."""
+        if cmd._stop_signal == new_stop_signal:
+            return
         with self._lock:
             cmd._stop_signal = new_stop_signal
+            self._invalidate_orders(cmd)
 
     def set_command_stop_time_allowed(self, cmd, new_stop_time_allowed):
         """Set how much time (seconds) to wait for a command to exit cleanly when
         stopping the command, before sending it a SIGKILL.  Integer values only.
         """
+        new_stop_time_allowed = int(new_stop_time_allowed)
+        if cmd._stop_time_allowed == new_stop_time_allowed:
+            return
         with self._lock:
-            cmd._stop_time_allowed = int(new_stop_time_allowed)
+            cmd._stop_time_allowed = new_stop_time_allowed
+            self._invalidate_orders(cmd)
 
     def _schedule_command_for_removal(self, cmd):
         if self._is_observer:
@@ -908,7 +1107,7 @@ class Sheriff(object):
         deputy = self._get_command_deputy(cmd)
         status_changes = deputy._schedule_for_removal(cmd)
         self._maybe_emit_status_change_signals(deputy, status_changes)
-        self._send_orders()
+        self._schedule_send_orders()
 
     def remove_command(self, cmd):
         """Remove a command.  This starts the process of purging a command from
@@ -935,22 +1134,25 @@ class Sheriff(object):
 
             self._is_observer = is_observer
             self.__observer_status_changed(is_observer)
+            if not is_observer:
+                # Start transmitting orders right away.
+                self._schedule_send_orders()
 
     def is_observer(self):
         """Check if the sheriff is in observer mode.
 
         @return True if the sheriff is in observer mode, False if not.
         """
-        with self._lock:
-            return self._is_observer
+        # Plain bool, safe to read without the lock.
+        return self._is_observer
 
     def get_deputies(self):
         """Retrieve a list of known deputies.
 
         @return a list of Deputy objects.
         """
-        with self._lock:
-            return list(self._deputies.values())
+        # _deputies is copy-on-write, so no lock is needed.
+        return list(self._deputies.values())
 
     def remove_empty_deputies(self):
         """Clean up the Sheriff internal state.
@@ -960,15 +1162,34 @@ class Sheriff(object):
         of deputies that don't have any commands.
         """
         with self._lock:
-            for deputy_id, deputy in list(self._deputies.items()):
-                cmds = list(deputy._commands.values())
-                if not deputy._commands or \
-                        all([ cmd._scheduled_for_removal for cmd in cmds ]):
-                    del self._deputies[deputy_id]
+            # all() is True for a deputy with no commands.
+            empty = [ deputy for deputy in self._deputies.values()
+                    if all(cmd._scheduled_for_removal
+                        for cmd in deputy._commands.values()) ]
+            if not empty:
+                return
+            deputies = dict(self._deputies)
+            for deputy in empty:
+                del deputies[deputy._deputy_id]
+            # Drop the deputies before cleaning up the command index, so that
+            # index entries aren't handed over to another removed deputy.
+            self._deputies = deputies
+            for deputy in empty:
+                for command_id in deputy._commands:
+                    self._remove_from_command_index(deputy, command_id)
 
     def _get_command_deputy(self, command):
-        for deputy in list(self._deputies.values()):
-            if command._command_id in deputy._commands:
+        # _lock should already be acquired
+        #
+        # Matches by identity, so that a command sharing its id with another
+        # deputy's command resolves to the deputy whose orders include it.
+        deputy = self._command_deputies.get(command._command_id)
+        if deputy is not None and deputy._owns_command(command):
+            return deputy
+        # The index only has one deputy per command id, so scan for commands
+        # that share their id with another deputy's command.
+        for deputy in self._deputies.values():
+            if deputy._owns_command(command):
                 return deputy
         raise KeyError("No such command")
 
@@ -984,10 +1205,9 @@ class Sheriff(object):
             return self._get_command_deputy(command)
 
     def _get_all_commands(self):
-        cmds = []
-        for dep in list(self._deputies.values()):
-            cmds.extend(list(dep._commands.values()))
-        return cmds
+        # _lock should already be acquired
+        return [ cmd for dep in self._deputies.values()
+                for cmd in dep._commands.values() ]
 
     def get_all_commands(self):
         """Retrieve all commands managed by all deputies.
@@ -998,10 +1218,11 @@ class Sheriff(object):
             return self._get_all_commands()
 
     def _get_command(self, cmd_id):
-        for deputy in list(self._deputies.values()):
-            if cmd_id in deputy._commands:
-                return deputy._commands[cmd_id]
-        return None
+        # _lock should already be acquired
+        deputy = self._command_deputies.get(cmd_id)
+        if deputy is None:
+            return None
+        return deputy._commands.get(cmd_id)
 
     def get_command(self, cmd_id):
         """Retrieve the command with the specified id.
@@ -1014,19 +1235,12 @@ class Sheriff(object):
             return self._get_command(cmd_id)
 
     def _get_commands_by_group(self, group_name):
-        result = []
-        group_name = group_name.strip("/")
-        while group_name.find("//") >= 0:
-            group_name = group_name.replace("//", "/")
-        group_parts = group_name.split("/")
-        for deputy in list(self._deputies.values()):
-            for cmd in list(deputy._commands.values()):
-                cmd_group_parts = cmd._group.split("/")
-                if len(group_parts) <= len(cmd_group_parts) and \
-                        all([ cgp == gp for cgp, gp in zip(group_parts,
-                            cmd_group_parts)]):
-                    result.append(cmd)
-        return result
+        group_name = sheriff_config.normalize_group_name(group_name)
+        group_parts = tuple(group_name.split("/"))
+        nparts = len(group_parts)
+        return [ cmd for deputy in self._deputies.values()
+                for cmd in deputy._commands.values()
+                if cmd._group_parts[:nparts] == group_parts ]
 
     def get_commands_by_group(self, group_name):
         """Retrieve a list of all commands in the specified group.  Use this
@@ -1040,35 +1254,40 @@ class Sheriff(object):
         with self._lock:
             return self._get_commands_by_group(group_name)
 
-    def _add_commands_from_config(self, group_node, name_prefix):
-        result = []
-        for cmd_node in group_node.commands:
-            auto_respawn_val = cmd_node.attributes.get("auto_respawn", "").lower()
-            auto_respawn = auto_respawn_val in [ "true", "yes" ]
-            assert group_node.name == cmd_node.attributes["group"]
-
-            stop_signal = cmd_node.attributes["stop_signal"]
-            stop_time_allowed = cmd_node.attributes["stop_time_allowed"]
-            if stop_signal == 0:
-                stop_signal = DEFAULT_STOP_SIGNAL
-            if stop_time_allowed == 0:
-                stop_time_allowed = DEFAULT_STOP_TIME_ALLOWED
-
-            self._add_command(cmd_node.attributes["command_id"],
-                    cmd_node.attributes["deputy"],
-                    cmd_node.attributes["exec"],
-                    name_prefix + group_node.name,
-                    auto_respawn,
-                    stop_signal,
-                    stop_time_allowed)
-
-        for subgroup in list(group_node.subgroups.values()):
+    def _add_commands_from_config(self, root_group):
+        # Walks the group tree with an explicit stack, visiting groups in the
+        # same pre-order as a recursive traversal would.
+        stack = [ (root_group, "") ]
+        while stack:
+            group_node, name_prefix = stack.pop()
+            group_name = name_prefix + group_node.name
+            for cmd_node in group_node.commands:
+                attributes = cmd_node.attributes
+                auto_respawn = attributes.get("auto_respawn", "").lower() in \
+                        _CONFIG_TRUE_VALUES
+                assert group_node.name == attributes["group"]
+
+                stop_signal = attributes["stop_signal"]
+                stop_time_allowed = attributes["stop_time_allowed"]
+                if stop_signal == 0:
+                    stop_signal = DEFAULT_STOP_SIGNAL
+                if stop_time_allowed == 0:
+                    stop_time_allowed = DEFAULT_STOP_TIME_ALLOWED
+
+                self._add_command(attributes["command_id"],
+                        attributes["deputy"],
+                        attributes["exec"],
+                        group_name,
+                        auto_respawn,
+                        stop_signal,
+                        stop_time_allowed)
+
             if group_node.name:
-                self._add_commands_from_config(subgroup,
-                    name_prefix + group_node.name + "/")
+                subgroup_prefix = name_prefix + group_node.name + "/"
             else:
-                self._add_commands_from_config(subgroup, "")
-        return result
+                subgroup_prefix = ""
+            stack.extend((subgroup, subgroup_prefix)
+                    for subgroup in reversed(list(group_node.subgroups.values())))
 
     def load_config(self, config_obj):
         """Load a process configuration from the specific config object.
@@ -1080,10 +1299,10 @@ class Sheriff(object):
             if self._is_observer:
                 raise ValueError("Can't load config in Observer mode")
 
-            if self._get_all_commands():
+            if any(deputy._commands for deputy in self._deputies.values()):
                 raise RuntimeError("Remove all commands before loading a config file")
 
-            self._add_commands_from_config(config_obj.root_group, "")
+            self._add_commands_from_config(config_obj.root_group)
 
     def save_config(self, config_obj):
         """Write the current sheriff configuration to the specified config
@@ -1094,9 +1313,11 @@ class Sheriff(object):
 
         @param config_obj output config object, created with make_empty_config().
         """
+        # Group nodes looked up so far, keyed by group name.
+        groups = {}
         with self._lock:
-            for deputy in list(self._deputies.values()):
-                for cmd in list(deputy._commands.values()):
+            for deputy in self._deputies.values():
+                for cmd in deputy._commands.values():
                     cmd_node = sheriff_config.CommandNode()
                     cmd_node.attributes["exec"] = cmd._exec_str
                     cmd_node.attributes["command_id"] = cmd._command_id
@@ -1104,7 +1325,10 @@ class Sheriff(object):
                     if cmd._auto_respawn:
                         cmd_node.attributes["auto_respawn"] = "true"
 
-                    group = config_obj.get_group(cmd._group, True)
+                    group = groups.get(cmd._group)
+                    if group is None:
+                        group = config_obj.get_group(cmd._group, True)
+                        groups[cmd._group] = group
                     group.add_command(cmd_node)
 
     def _lcm_thread(self):
@@ -1112,36 +1336,72 @@ class Sheriff(object):
             self._lcm.handle_timeout(200)
 
     def _worker_thread(self):
-        send_interval = 1.0
-        next_send = time.time() + send_interval
-        to_call = []
+        send_interval = _ORDERS_SEND_INTERVAL
+        # Use a monotonic clock so that wall clock adjustments don't delay or
+        # bunch up transmissions.
+        next_send = time.monotonic() + send_interval
         while True:
-            with self._lock:
+            with self._emit_lock:
                 if self._exiting:
-                    return
-
-                now = time.time()
-
-                # Calculate how long to wait on the condition variable.
+                    # Orders are only sent from this thread, so send any
+                    # changes made since the last transmission (e.g., stopping
+                    # a command right before shutdown()) before exiting.
+                    send_now = self._orders_dirty
+                    self._orders_dirty = False
+                    break
+
+                now = time.monotonic()
+
+                # Calculate how long to wait on the condition variable.  Don't
+                # wait at all if there's already work to do, since the
+                # corresponding notify() may have happened before this thread
+                # started waiting.
                 wait_time = next_send - now
 
-                if wait_time > 0:
+                if wait_time > 0 and not self._orders_dirty and \
+                        not self._queued_events:
                     self._condvar.wait(wait_time)
 
-                # Queue up any listener notifications to invoke afer releasing the lock
-                for event in self._queued_events:
-                    for listener in self._listeners:
-                        to_call.append((event, listener))
-                del self._queued_events[:]
-
-                now = time.time()
+                # Take the queued listener notifications to invoke after
+                # releasing the lock
+                events = self._queued_events
+                self._queued_events = collections.deque()
+                listeners = list(self._listeners)
+                self._pending_status_changes.clear()
+
+                # Clear the dirty flag before sending.  Any modification made
+                # after this point sets it again and is picked up on the next
+                # iteration.
+                now = time.monotonic()
+                send_now = now > next_send or self._orders_dirty
+                self._orders_dirty = False
                 if now > next_send:
+                    # If the thread fell more than an interval behind, skip
+                    # ahead rather than sending a burst of catch-up orders.
+                    next_send += send_interval
+                    if next_send < now:
+                        next_send = now + send_interval
+
+            if send_now:
+                with self._lock:
                     if not self._is_observer:
                         self._send_orders()
-                    next_send = min(time.time() + send_interval,
-                            next_send + send_interval)
 
             # Emit any queued up signals
-            for func, listener in to_call:
-                func(listener)
-            del to_call[:]
+            for event in events:
+                method_name = event[0]
+                if method_name == "command_status_changed":
+                    cmd_obj, (old_status, new_status) = event[1:]
+                    # A change that ended up back where it started is dropped.
+                    if old_status == new_status:
+                        continue
+                    args = (cmd_obj, old_status, new_status)
+                else:
+                    args = event[1:]
+                for listener in listeners:
+                    getattr(listener, method_name)(*args)
+
+        if send_now:
+            with self._lock:
+                if not self._is_observer:
+                    self._send_orders()
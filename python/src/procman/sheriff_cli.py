@@ -1,5 +1,6 @@
 import getopt
 import os
+import select
 import signal
 import subprocess
 import sys
@@ -23,14 +24,24 @@ try:
 except ImportError:
     BUILD_PREFIX = None
 
+# Path found by find_procman_deputy_cmd(), cached since the search stats every
+# directory in PATH.  A failed search isn't cached, in case the deputy is
+# installed later.
+_procman_deputy_cmd = None
+
 def find_procman_deputy_cmd():
+    global _procman_deputy_cmd
+    if _procman_deputy_cmd is not None:
+        return _procman_deputy_cmd
     search_path = []
     if BUILD_PREFIX is not None:
         search_path.append("%s/bin" % BUILD_PREFIX)
     search_path.extend(os.getenv("PATH").split(":"))
     for dirname in search_path:
         fname = "%s/procman-deputy" % dirname
-        if os.path.exists(fname) and os.path.isfile(fname):
+        # isfile() is False for missing paths, so no separate exists() check.
+        if os.path.isfile(fname):
+            _procman_deputy_cmd = fname
             return fname
     return None
 
@@ -46,6 +57,11 @@ class SheriffHeadless(ScriptListener):
         self.mainloop = None
         self.lcm_obj = lcm_obj
         self._should_exit = False
+        # Self-pipe used by _request_exit() to wake up the main loop, which
+        # otherwise sleeps until LCM traffic arrives.  Only open while run()
+        # is in its main loop.
+        self._wake_r = None
+        self._wake_w = None
         if script_done_action is None:
             self.script_done_action = "exit"
         else:
@@ -84,6 +100,17 @@ class SheriffHeadless(ScriptListener):
 
     def _request_exit(self):
         self._should_exit = True
+        if self._wake_w is None:
+            return
+        try:
+            os.write(self._wake_w, b"x")
+        except OSError:
+            # The pipe is full or already closed, so the loop is exiting
+            # anyway.
+            pass
+
+    def _on_signal(self, signum, frame):
+        self._request_exit()
 
     def run(self):
         # parse the config file
@@ -118,17 +145,26 @@ class SheriffHeadless(ScriptListener):
 
             self.script_manager.add_listener(self)
 
-        signal.signal(signal.SIGINT, lambda *s: self._request_exit())
-        signal.signal(signal.SIGTERM, lambda *s: self._request_exit())
-        signal.signal(signal.SIGHUP, lambda *s: self._request_exit())
-
+        self._wake_r, self._wake_w = os.pipe()
+        old_wakeup_fd = None
         try:
+            os.set_blocking(self._wake_w, False)
+            for signum in (signal.SIGINT, signal.SIGTERM, signal.SIGHUP):
+                signal.signal(signum, self._on_signal)
+            # Also have the interpreter write to the wake-up pipe as soon as
+            # a signal arrives, so select() returns even before the handler
+            # runs.
+            old_wakeup_fd = signal.set_wakeup_fd(self._wake_w)
+
             if self.script:
                 time.sleep(0.2)
                 self._start_script()
 
+            lcm_fd = self.lcm_obj.fileno()
             while not self._should_exit:
-                self.lcm_obj.handle_timeout(200)
+                readable, _, _ = select.select([ lcm_fd, self._wake_r ], [], [])
+                if lcm_fd in readable:
+                    self.lcm_obj.handle()
         except KeyboardInterrupt:
             pass
         except IOError:
@@ -136,6 +172,12 @@ class SheriffHeadless(ScriptListener):
         finally:
             print("Sheriff terminating..")
             self._shutdown()
+            if old_wakeup_fd is not None:
+                signal.set_wakeup_fd(old_wakeup_fd)
+            os.close(self._wake_r)
+            os.close(self._wake_w)
+            self._wake_r = None
+            self._wake_w = None
 
         return 0
 
@@ -203,7 +245,8 @@ def main():
     script_name = None
     if len(args) > 0:
         try:
-            cfg = sheriff.load_config_file(file(args[0]))
+            with open(args[0]) as config_file:
+                cfg = sheriff.load_config_file(config_file)
         except Exception as xcp:
             print("Unable to load config file.")
             print(xcp)
@@ -219,7 +262,7 @@ def main():
             print("Lone ranger mode and observer mode are mutually exclusive.")
             sys.exit(1)
 
-    lcm_obj = LCM()
+    lcm_obj = lcm.LCM()
 
     SheriffHeadless(lcm_obj, cfg, spawn_deputy, script_name, script_done_action).run()
 
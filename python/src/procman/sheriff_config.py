@@ -1,3 +1,5 @@
+import re
+
 TokIdentifier = "Identifier"
 TokOpenStruct = "OpenStruct"
 TokCloseStruct = "CloseStruct"
@@ -143,6 +145,13 @@ def escape_str(text):
 
     return "".join([ escape_char(c) for c in text ])
 
+_MULTI_SLASH_RE = re.compile(r"/{2,}")
+
+def normalize_group_name(name):
+    """Strips leading and trailing slashes from a group name, and collapses
+    repeated slashes."""
+    return _MULTI_SLASH_RE.sub("/", name.strip("/"))
+
 class CommandNode(object):
     def __init__ (self):
         self.attributes = { \
@@ -288,11 +297,10 @@ class ConfigNode(object):
         self.root_group = GroupNode("")
 
     def _normalize_group_name(self, name):
-        if not name.startswith("/"):
-            name = "/" + name
-        while name.find("//") >= 0:
-            name = name.replace("//", "/")
-        return name.rstrip("/")
+        name = normalize_group_name(name)
+        if not name:
+            return ""
+        return "/" + name
 
     def has_group(self, group_name):
         name = self._normalize_group_name(group_name)
@@ -533,5 +541,6 @@ if __name__ == "__main__":
         print("usage: sheriff_config.py <fname>")
         sys.exit (1)
 
-    config = Parser().parse(file(fname))
+    with open(fname) as f:
+        config = Parser().parse(f)
     print(config)
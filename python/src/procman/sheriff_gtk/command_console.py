@@ -1,7 +1,7 @@
 import os
+import re
 import time
 import threading
-import functools
 
 from gi.repository import GLib
 from gi.repository import GObject
@@ -36,6 +36,9 @@ ANSI_CODES_TO_TEXT_TAG_PROPERTIES = {
     "47": ("background", "white"),
 }
 
+# ANSI SGR escape sequence, e.g. "\x1b[1;31m".  Group 1 is the parameter list.
+_ANSI_SGR_RE = re.compile(r"\x1b\[([0-9;]*)m")
+
 
 def now_str():
     return time.strftime("[%H:%M:%S] ")
@@ -93,6 +96,14 @@ class SheriffCommandConsole(Gtk.ScrolledWindow, SheriffListener):
 
         self._cmd_extradata = {}
 
+        # (command_id, text) pairs received from LCM and not yet added to the
+        # console.  LCM messages are handled from the GTK main loop, so all
+        # output received between two idle callbacks is handled in one batch.
+        self._pending_output = []
+
+        # Text buffers with a trim already scheduled by _add_text_to_buffer()
+        self._buffers_to_trim = set()
+
         lc.subscribe ("PM_OUTPUT", self.on_procman_output)
 
         self.text_tags = {"normal": Gtk.TextTag.new("normal")}
@@ -166,16 +177,17 @@ class SheriffCommandConsole(Gtk.ScrolledWindow, SheriffListener):
             extradata.printf_drop_count = 0
         return True
 
-    def _tag_from_seg(self, seg):
-        esc_seq, seg = seg.split("m", 1)
-        if not esc_seq:
-            esc_seq = "0"
-        key = esc_seq
-        codes = esc_seq.split(";")
-        if len(codes) > 0:
-            codes.sort()
-            key = ";".join(codes)
-        if key not in self.text_tags:
+    def _tag_for_params(self, params):
+        # text_tags is also keyed by the raw parameter strings seen so far, so
+        # a recurring sequence is a single lookup.
+        tag = self.text_tags.get(params)
+        if tag is not None:
+            return tag
+        codes = (params or "0").split(";")
+        codes.sort()
+        key = ";".join(codes)
+        tag = self.text_tags.get(key)
+        if tag is None:
             tag = Gtk.TextTag.new(key)
             for code in codes:
                 if code in ANSI_CODES_TO_TEXT_TAG_PROPERTIES:
@@ -183,7 +195,8 @@ class SheriffCommandConsole(Gtk.ScrolledWindow, SheriffListener):
                     tag.set_property(propname, propval)
             self.sheriff_tb.get_tag_table().add(tag)
             self.text_tags[key] = tag
-        return self.text_tags[key], seg
+        self.text_tags[params] = tag
+        return tag
 
     def _add_text_to_buffer(self, tb, text):
         if not text:
@@ -191,28 +204,35 @@ class SheriffCommandConsole(Gtk.ScrolledWindow, SheriffListener):
 
         # interpret text as ANSI escape sequences?  Try to format colors...
         tag = self.text_tags["normal"]
-        for segnum, seg in enumerate(text.split("\x1b[")):
-            if not seg:
-                continue
-            if segnum > 0:
-                try:
-                    tag, seg = self._tag_from_seg(seg)
-                except ValueError:
-                    pass
-            end_iter = tb.get_end_iter()
-            tb.insert_with_tags(end_iter, seg, tag)
-
-        # toss out old text if the buffer is getting too big
+        last_end = 0
+        for match in _ANSI_SGR_RE.finditer(text):
+            start = match.start()
+            if start > last_end:
+                tb.insert_with_tags(tb.get_end_iter(), text[last_end:start], tag)
+            tag = self._tag_for_params(match.group(1))
+            last_end = match.end()
+        if last_end < len(text):
+            tb.insert_with_tags(tb.get_end_iter(), text[last_end:], tag)
+
+        # toss out old text if the buffer is getting too big.  Must use
+        # idle_add here otherwise the output console will not be updated
+        # correctly.  Only one trim per buffer is scheduled at a time, and it
+        # trims whatever has accumulated by the time it runs.
+        if tb.get_line_count() > self.stdout_maxlines and \
+                tb not in self._buffers_to_trim:
+            self._buffers_to_trim.add(tb)
+            GLib.idle_add(self._trim_buffer, tb)
+
+    def _trim_buffer(self, tb):
+        self._buffers_to_trim.discard(tb)
         num_lines = tb.get_line_count()
         if num_lines > self.stdout_maxlines:
+            # Fetch the iters now, since any earlier ones were invalidated by
+            # later inserts.
             start_iter = tb.get_start_iter()
             chop_iter = tb.get_iter_at_line(num_lines - self.stdout_maxlines)
-            # Must use idle_add here otherwise the output console will not be updated correctly
-            GLib.idle_add(functools.partial(
-                self.del_tb, start_iter, chop_iter))
-
-    def del_tb(self, start, chop):
-        self.sheriff_tb.delete(start, chop)
+            tb.delete(start_iter, chop_iter)
+        return False
 
     # Sheriff event handlers
     def _gtk_on_sheriff_command_added(self, deputy, command):
@@ -343,12 +363,22 @@ class SheriffCommandConsole(Gtk.ScrolledWindow, SheriffListener):
 
         self._add_text_to_buffer(extradata.tb, toadd)
 
+    def _handle_pending_output(self):
+        pending = self._pending_output
+        self._pending_output = []
+        for command_id, text in pending:
+            self._handle_command_output(command_id, text)
+        return False
+
     def on_procman_output(self, channel, data):
         msg = output_t.decode(data)
+        if not msg.num_commands:
+            return
+        # Only schedule an idle callback if one isn't already pending.
+        if not self._pending_output:
+            GLib.idle_add(self._handle_pending_output)
         for i in range(msg.num_commands):
-            command_id = msg.command_ids[i]
-            text = msg.text[i]
-            GLib.idle_add(self._handle_command_output, command_id, text)
+            self._pending_output.append((msg.command_ids[i], msg.text[i]))
 
     def show_command_buffer(self, cmd):
         extradata = self._cmd_extradata.get(cmd, None)
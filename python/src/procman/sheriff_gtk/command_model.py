@@ -34,9 +34,26 @@ class SheriffCommandModel(Gtk.TreeStore):
         self.sheriff = _sheriff
         self.group_row_references = {}
         self.populate_exec_with_group_name = False
+        # Maps group name to the commands under that group.  Only set while
+        # repopulate() is updating the group rows, when the tree structure
+        # doesn't change.
+        self._group_children_cache = None
 
         self.set_sort_column_id(COL_CMDS_TV_COMMAND_ID, Gtk.SortType.ASCENDING)
 
+    def _make_cmd_row(self, cmd, deputy_id, cpu_str, mem_usage):
+        return (
+            cmd,  # COL_CMDS_TV_OBJ
+            cmd.exec_str,  # COL_CMDS_TV_EXEC
+            "",  # COL_CMDS_TV_FULL_GROUP
+            cmd.command_id,  # COL_CMDS_TV_COMMAND_ID
+            deputy_id,  # COL_CMDS_TV_DEPUTY
+            cmd.status(),  # COL_CMDS_TV_STATUS_ACTUAL
+            cpu_str,  # COL_CMDS_TV_CPU_USAGE
+            mem_usage,  # COL_CMDS_TV_MEM_RSS
+            cmd.auto_respawn,  # COL_CMDS_TV_AUTO_RESPAWN
+        )
+
     def _find_or_make_group_row_reference(self, group_name):
         if not group_name:
             return None
@@ -84,16 +101,38 @@ class SheriffCommandModel(Gtk.TreeStore):
         del self.group_row_references[group_name]
         self.remove(model_iter)
 
-    def _is_group_row(self, model_iter):
-        return self.iter_to_command(model_iter) is None
-
-    def _update_cmd_row(self, model_rr, cmd_deps, to_reparent):
-        path = model_rr.get_path()
-        model_iter = self.get_iter(path)
-        cmd = self.iter_to_command(model_iter)
+    def _update_cmd_row(self, model_iter, cmd, cmd_deputy_ids, to_reparent):
         cpu_str = "{:.2f}".format(cmd.cpu_usage * 100)
         mem_usage = int(cmd.mem_rss_bytes / 1024)
 
+        # check that the command is in the correct group in the
+        # treemodel.  TreeStore iters stay valid when rows are added or
+        # reordered, so model_iter can still be used after adding a group.
+        correct_grr = self._find_or_make_group_row_reference(cmd.group)
+        correct_parent_iter = None
+        correct_parent_path = None
+        actual_parent_path = None
+        if correct_grr and correct_grr.get_path() is not None:
+            correct_parent_iter = self.get_iter(correct_grr.get_path())
+        actual_parent_iter = self.iter_parent(model_iter)
+
+        if correct_parent_iter:
+            correct_parent_path = self.get_path(correct_parent_iter)
+        if actual_parent_iter:
+            actual_parent_path = self.get_path(actual_parent_iter)
+
+        if correct_parent_path != actual_parent_path:
+            # schedule the command to be moved.  The row is recreated under
+            # its new parent with up to date values, so don't bother setting
+            # them on the old row.  Moving rows removes them, so refer to the
+            # row by a row reference from here on.
+            model_rr = Gtk.TreeRowReference(self, self.get_path(model_iter))
+            new_row = self._make_cmd_row(
+                cmd, cmd_deputy_ids[cmd], cpu_str, mem_usage
+            )
+            to_reparent.append((model_rr, correct_grr, new_row))
+            return
+
         self.set(
             model_iter,
             COL_CMDS_TV_EXEC,
@@ -103,7 +142,7 @@ class SheriffCommandModel(Gtk.TreeStore):
             COL_CMDS_TV_STATUS_ACTUAL,
             cmd.status(),
             COL_CMDS_TV_DEPUTY,
-            cmd_deps[cmd].deputy_id,
+            cmd_deputy_ids[cmd],
             COL_CMDS_TV_CPU_USAGE,
             cpu_str,
             COL_CMDS_TV_MEM_RSS,
@@ -112,61 +151,45 @@ class SheriffCommandModel(Gtk.TreeStore):
             cmd.auto_respawn,
         )
 
-        # get a row reference to the model since
-        # adding a group may invalidate the iterators
-        model_rr = Gtk.TreeRowReference(self, path)
-
-        # check that the command is in the correct group in the
-        # treemodel
-        correct_grr = self._find_or_make_group_row_reference(cmd.group)
-        correct_parent_iter = None
-        correct_parent_path = None
-        actual_parent_path = None
-        if correct_grr and correct_grr.get_path() is not None:
-            correct_parent_iter = self.get_iter(correct_grr.get_path())
-        actual_parent_iter = self.iter_parent(
-            self.get_iter(model_rr.get_path())
-        )  # use the model_rr in case model_iter was invalidated
-
-        if correct_parent_iter:
-            correct_parent_path = self.get_path(correct_parent_iter)
-        if actual_parent_iter:
-            actual_parent_path = self.get_path(actual_parent_iter)
-
-        if correct_parent_path != actual_parent_path:
-            # schedule the command to be moved
-            to_reparent.append((model_rr, correct_grr))
-
-    #                print "moving %s (%s) (%s)" % (cmd.name,
-    #                        correct_parent_path, actual_parent_path)
-
-    def _update_group_row(self, group_rr, cmd_deps):
-        model_iter = self.get_iter(group_rr.get_path())
+    def _update_group_row(self, model_iter, cmd_deputy_ids):
         # row represents a procman group
         children = self.get_group_row_child_commands_recursive(model_iter)
         if not children:
             return
 
-        # aggregate command status
-        statuses = [cmd.status() for cmd in children]
-        stopped_statuses = [sheriff.STOPPED_OK, sheriff.STOPPED_ERROR]
-        if all([s == statuses[0] for s in statuses]):
-            status_str = statuses[0]
-        elif all([s in stopped_statuses for s in statuses]):
+        # aggregate command status, deputy information, and CPU and memory
+        # usage in a single pass over the children
+        stopped_statuses = (sheriff.STOPPED_OK, sheriff.STOPPED_ERROR)
+        first_status = children[0].status()
+        all_same = True
+        all_stopped = True
+        child_dep_ids = set()
+        cpu_total = 0
+        mem_total = 0
+        for cmd in children:
+            status = cmd.status()
+            if status != first_status:
+                all_same = False
+            if status not in stopped_statuses:
+                all_stopped = False
+            deputy_id = cmd_deputy_ids.get(cmd)
+            if deputy_id is not None:
+                child_dep_ids.add(deputy_id)
+            cpu_total += cmd.cpu_usage
+            mem_total += cmd.mem_rss_bytes / 1024
+
+        if all_same:
+            status_str = first_status
+        elif all_stopped:
             status_str = "Stopped (Mixed)"
         else:
             status_str = "Mixed"
 
-        # aggregate deputy information
-        child_deps = {cmd_deps[child] for child in children if child in cmd_deps}
-        if len(child_deps) == 1:
-            dep_str = child_deps.pop().deputy_id
+        if len(child_dep_ids) == 1:
+            dep_str = child_dep_ids.pop()
         else:
             dep_str = "Mixed"
 
-        # aggregate CPU and memory usage
-        cpu_total = sum([cmd.cpu_usage for cmd in children])
-        mem_total = sum([cmd.mem_rss_bytes / 1024 for cmd in children])
         cpu_str = "{:.2f}".format(cpu_total * 100)
 
         # display group name in command column?
@@ -191,102 +214,115 @@ class SheriffCommandModel(Gtk.TreeStore):
 
     def _dispatch_row_changes(self, model, path, model_iter, user_data):
         (
-            cmds_to_add,
+            cmd_deputy_ids,
+            existing_cmds,
             cmd_rows_to_remove,
             cmds_rows_to_update,
             group_rows_to_update,
         ) = user_data
+        # Only rows that will be removed need a row reference.  Updates don't
+        # remove rows, so the rows to update are kept as iters, which are
+        # copied since the one passed in is only valid during the callback.
         cmd = self.iter_to_command(model_iter)
         if cmd:
-            if cmd in cmds_to_add:
-                cmds_rows_to_update.append(Gtk.TreeRowReference(model, path))
-                cmds_to_add.remove(cmd)
+            if cmd in cmd_deputy_ids and cmd not in existing_cmds:
+                cmds_rows_to_update.append((model_iter.copy(), cmd))
+                existing_cmds.add(cmd)
             else:
                 cmd_rows_to_remove.append(Gtk.TreeRowReference(model, path))
         else:
-            group_rows_to_update.append(Gtk.TreeRowReference(model, path))
+            group_rows_to_update.append(model_iter.copy())
 
     def repopulate(self):
-        cmds_to_add = set()
-        cmd_deps = {}
+        # Only the deputy ids are displayed, so map each command straight to
+        # its deputy's id.
+        cmd_deputy_ids = {}
         for deputy in self.sheriff.get_deputies():
+            deputy_id = deputy.deputy_id
             for cmd in deputy.get_commands():
-                cmd_deps[cmd] = deputy
-                cmds_to_add.add(cmd)
+                cmd_deputy_ids[cmd] = deputy_id
+        existing_cmds = set()
         cmd_rows_to_remove = []
         cmd_rows_to_reparent = []
         cmds_rows_to_update = []
         group_rows_to_update = []
 
         # Figure out which rows should be added/updated/removed etc...
-        # On return, the cmds_to_add set will
-        # contain commands that were not updated (i.e., commands that need to
-        # be added into the model)
+        # On return, the existing_cmds set will contain commands that already
+        # have a row in the model.  The rest need to be added.
         self.foreach(
             self._dispatch_row_changes,
             (
-                cmds_to_add,
+                cmd_deputy_ids,
+                existing_cmds,
                 cmd_rows_to_remove,
                 cmds_rows_to_update,
                 group_rows_to_update,
             ),
         )
+        cmds_to_add = cmd_deputy_ids.keys() - existing_cmds
 
         # update the command rows that should be updated
-        for trr in cmds_rows_to_update:
-            self._update_cmd_row(trr, cmd_deps, cmd_rows_to_reparent)
-
-        # update the group rows that should be updated
-        for trr in group_rows_to_update:
-            self._update_group_row(trr, cmd_deps)
-
-        # reparent rows that are in the wrong group
-        for trr, newparent_rr in cmd_rows_to_reparent:
-            orig_iter = self.get_iter(trr.get_path())
-            rowdata = self.get(orig_iter, *list(range(NUM_CMDS_ROWS)))
-            self.remove(orig_iter)
-
-            newparent_iter = None
-            if newparent_rr:
-                newparent_iter = self.get_iter(newparent_rr.get_path())
-            self.append(newparent_iter, rowdata)
-
-        # remove rows that have been marked for deletion
-        for trr in cmd_rows_to_remove:
-            self.remove(self.get_iter(trr.get_path()))
-
-        # remove group rows with no children
-        groups_to_remove = []
-
-        def _check_for_lonely_groups(model, path, model_iter, user_data):
-            is_group = self._is_group_row(model_iter)
-            if is_group and not model.iter_has_child(model_iter):
-                groups_to_remove.append(Gtk.TreeRowReference(model, path))
-
-        self.foreach(_check_for_lonely_groups, None)
-        for trr in groups_to_remove:
-            self._delete_group_row_reference(trr)
-
-        # create new rows for new commands
-        for cmd in cmds_to_add:
-            deputy = cmd_deps[cmd]
-            parent = self._find_or_make_group_row_reference(cmd.group)
-
-            new_row = (
-                cmd,  # COL_CMDS_TV_OBJ
-                cmd.exec_str,  # COL_CMDS_TV_EXEC
-                "",  # COL_CMDS_TV_FULL_GROUP
-                cmd.command_id,  # COL_CMDS_TV_COMMAND_ID
-                deputy.deputy_id,  # COL_CMDS_TV_DEPUTY
-                cmd.status(),  # COL_CMDS_TV_STATUS_ACTUAL
-                "0",  # COL_CMDS_TV_CPU_USAGE
-                0,  # COL_CMDS_TV_MEM_RSS
-                cmd.auto_respawn,  # COL_CMDS_TV_AUTO_RESPAWN
+        for model_iter, cmd in cmds_rows_to_update:
+            self._update_cmd_row(model_iter, cmd, cmd_deputy_ids, cmd_rows_to_reparent)
+
+        # update the group rows that should be updated.  Nested groups would
+        # otherwise walk the same subtrees once per ancestor.
+        self._group_children_cache = {}
+        try:
+            for model_iter in group_rows_to_update:
+                self._update_group_row(model_iter, cmd_deputy_ids)
+        finally:
+            self._group_children_cache = None
+
+        # Inserting into a sorted store re-sorts the new row's siblings on
+        # every insert.  When rows are being added or moved, turn sorting off
+        # and sort once at the end instead.
+        sort_column_id, sort_order = self.get_sort_column_id()
+        suspend_sort = sort_column_id is not None and bool(
+            cmds_to_add or cmd_rows_to_reparent
+        )
+        if suspend_sort:
+            self.set_sort_column_id(
+                Gtk.TREE_SORTABLE_UNSORTED_SORT_COLUMN_ID, sort_order
             )
-            if parent:
-                self.append(self.get_iter(parent.get_path()), new_row)
-            else:
-                self.append(None, new_row)
+        try:
+            # reparent rows that are in the wrong group
+            for trr, newparent_rr, rowdata in cmd_rows_to_reparent:
+                self.remove(self.get_iter(trr.get_path()))
+
+                newparent_iter = None
+                if newparent_rr:
+                    newparent_iter = self.get_iter(newparent_rr.get_path())
+                self.append(newparent_iter, rowdata)
+
+            # remove rows that have been marked for deletion
+            for trr in cmd_rows_to_remove:
+                self.remove(self.get_iter(trr.get_path()))
+
+            # remove group rows with no children.  Every group row has an entry
+            # in group_row_references, so there's no need to walk the command
+            # rows again.
+            groups_to_remove = [
+                trr
+                for trr in self.group_row_references.values()
+                if not self.iter_has_child(self.get_iter(trr.get_path()))
+            ]
+            for trr in groups_to_remove:
+                self._delete_group_row_reference(trr)
+
+            # create new rows for new commands
+            for cmd in cmds_to_add:
+                parent = self._find_or_make_group_row_reference(cmd.group)
+
+                new_row = self._make_cmd_row(cmd, cmd_deputy_ids[cmd], "0", 0)
+                if parent:
+                    self.append(self.get_iter(parent.get_path()), new_row)
+                else:
+                    self.append(None, new_row)
+        finally:
+            if suspend_sort:
+                self.set_sort_column_id(sort_column_id, sort_order)
 
     def rows_to_commands(self, rows):
         col = COL_CMDS_TV_OBJ
@@ -308,6 +344,17 @@ class SheriffCommandModel(Gtk.TreeStore):
         return self.iter_to_command(self.get_iter(path))
 
     def get_group_row_child_commands_recursive(self, group_iter):
+        cache = self._group_children_cache
+        if cache is not None:
+            group_name = self.get_value(group_iter, COL_CMDS_TV_FULL_GROUP)
+            children = cache.get(group_name)
+            if children is None:
+                children = self._get_group_row_child_commands(group_iter)
+                cache[group_name] = children
+            return children
+        return self._get_group_row_child_commands(group_iter)
+
+    def _get_group_row_child_commands(self, group_iter):
         child_iter = self.iter_children(group_iter)
         children = []
         while child_iter:
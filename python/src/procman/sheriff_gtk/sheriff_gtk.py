@@ -76,10 +76,7 @@ def find_icon():
     
 
 def split_script_name(name):
-    name = name.strip("/")
-    while name.find("//") >= 0:
-        name = name.replace("//", "/")
-    return name.split("/")
+    return sheriff_config.normalize_group_name(name).split("/")
 
 
 class SheriffGtk(SheriffListener):